@@ -0,0 +1,11 @@
+"""PDF text extraction, kept free of heavy imports so worker processes start quickly."""
+
+import io
+from pypdf import PdfReader
+
+
+def extract_pdf_text(file_content: bytes) -> str:
+    pdf = PdfReader(io.BytesIO(file_content))
+    # Join once instead of growing a string page by page; pages with no
+    # extractable text come back as None
+    return "".join((page.extract_text() or "") + "\n" for page in pdf.pages)
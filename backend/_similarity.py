@@ -0,0 +1,56 @@
+"""Numba similarity kernels, used for RAG search when SimSIMD isn't installed."""
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _dot_scores(matrix, query):
+        # One row per iteration across cores; the inner loop vectorizes
+        n, d = matrix.shape
+        scores = np.empty(n, dtype=np.float32)
+        for i in prange(n):
+            acc = np.float32(0.0)
+            for j in range(d):
+                acc += matrix[i, j] * query[j]
+            scores[i] = acc
+        return scores
+
+    @njit(cache=True)
+    def _select_top(scores, k):
+        # Insertion into a small sorted buffer, best first (k is a handful)
+        top = np.full(k, -1, dtype=np.int64)
+        top_scores = np.full(k, -np.inf, dtype=np.float32)
+        for i in range(scores.shape[0]):
+            score = scores[i]
+            if not score > top_scores[k - 1]:
+                continue
+            pos = k - 1
+            while pos > 0 and top_scores[pos - 1] < score:
+                top_scores[pos] = top_scores[pos - 1]
+                top[pos] = top[pos - 1]
+                pos -= 1
+            top_scores[pos] = score
+            top[pos] = i
+        return top
+
+
+def top_k_dot(matrix: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k rows of `matrix` with the largest dot product with `query`.
+
+    Rows are expected to be L2-normalized, so this is cosine similarity.
+    Requires numba (see `available`).
+    """
+    k = min(k, matrix.shape[0])
+    scores = _dot_scores(np.asarray(matrix, dtype=np.float32), np.asarray(query, dtype=np.float32))
+    top = _select_top(scores, k)
+    return top[top >= 0]
+
+
+available = njit is not None
@@ -22,5 +22,25 @@ CHAIRMAN_MODEL = "tngtech/deepseek-r1t2-chimera:free"
 # OpenRouter API endpoint
 OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
 
+# Max concurrent requests per provider (the prefix of the model identifier)
+CONCURRENCY_LIMIT = 2
+PROVIDER_CONCURRENCY_LIMITS = {
+    "openai": 8,
+    "anthropic": 4,
+}
+
+# Proactive per-provider rate limits (requests / estimated tokens per minute, 0 disables)
+OPENROUTER_RPM = int(os.getenv("OPENROUTER_RPM", "60"))
+OPENROUTER_TPM = int(os.getenv("OPENROUTER_TPM", "0"))
+
+# Embedding inference backend for RAG: "torch", or "onnx" to run an
+# int8-quantized export on ONNX Runtime (CPU only, needs optimum-onnx installed by hand, see README)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+
 # Data directory for conversation storage
 DATA_DIR = "data/conversations"
+
+# Semantic response cache - reuse responses for near-duplicate queries
+SEMANTIC_CACHE_THRESHOLD = 0.87
+SEMANTIC_CACHE_MAX_ENTRIES = 10000
@@ -1,71 +1,233 @@
 """3-stage LLM Council orchestration."""
 
-from .openrouter import query_models_parallel, query_model, query_model_stream # explicitly import query_model_stream
+import asyncio
+import hashlib
+import json
+import re
+from collections import OrderedDict
+from .openrouter import query_model, query_model_stream, encode_messages # explicitly import query_model_stream
 from .config import COUNCIL_MODELS, CHAIRMAN_MODEL
-from typing import List, Dict, Any, Tuple
+from .semantic_cache import semantic_cache, make_namespace
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+
+# Words dropped when deriving a conversation title from the first message
+TITLE_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "can", "could", "do", "does",
+    "for", "from", "how", "i", "in", "is", "it", "me", "my", "of", "on", "or",
+    "please", "should", "so", "that", "the", "this", "to", "was", "what",
+    "when", "where", "which", "who", "why", "will", "with", "would", "you",
+    "your",
+}
+
+# Estimated token budget for verbatim history in the chairman prompt;
+# older turns are replaced by a cached summary
+HISTORY_TOKEN_BUDGET = 3000
+HISTORY_SUMMARY_CACHE_SIZE = 256
+
+# Maps a digest of a history prefix to a summary of that prefix
+_history_summaries: "OrderedDict[str, str]" = OrderedDict()
+
+# Static parts of the chairman prompt
+_CHAIRMAN_PREAMBLE_HEAD = (
+    "You are the Chairman of an LLM Council. Multiple AI models have provided responses to a user's question.\n\n"
+)
+_CHAIRMAN_PREAMBLE_TAIL = """
+
+Your task as Chairman is to synthesize all of this information into a single, comprehensive, accurate answer to the user's original question. Consider:
+- The individual responses and their insights
+- Any patterns of agreement or disagreement
+
+Provide a clear, well-reasoned final answer that represents the council's collective wisdom:"""
+
+# Asks the first council model to title a new conversation in its Stage 1 answer
+TITLE_INSTRUCTION = "First, output a 3-5 word title wrapped in <title></title> tags, then answer normally."
+_TITLE_TAG_RE = re.compile(r"<title>(.*?)</title>", re.DOTALL)
+
+# Stage 3 response used when the chairman model fails
+CHAIRMAN_UNAVAILABLE_RESPONSE = "The Chairman model is currently unavailable or encountered an error. Please refer to the council member responses above."
 
 
 async def stage1_collect_responses(
     user_query: str, 
     history: List[Dict[str, str]] = [],
-    context: str = ""
-) -> List[Dict[str, Any]]:
+    context: str = "",
+    request_title: bool = False
+) -> AsyncIterator[Dict[str, Any]]:
     """
     Stage 1: Collect individual responses from all council models.
 
+    Responses are yielded as soon as each model finishes, so the slowest
+    model no longer delays the others.
+
     Args:
         user_query: The user's question
         history: Previous conversation history
         context: RAG context string
+        request_title: Ask the first council model to also title the conversation
 
-    Returns:
-        List of dicts with 'model' and 'response' keys
+    Yields:
+        Dicts with 'model' and 'response' keys, in completion order. The first
+        council model's dict also has a 'title' key when request_title is set
+        and the model supplied one.
     """
     # Construct message content with context
     content = user_query
     if context:
         content = f"Reference Documents:\n{context}\n\nQuestion: {user_query}"
 
-    # Combine history with new user query
+    # Combine history with new user query, serialized once for all models
     messages = history + [{"role": "user", "content": content}]
+    messages_json = encode_messages(messages)
+
+    # Every council model's cache lookup compares the same query; embed it once
+    query_embedding = await semantic_cache.embed(user_query)
+
+    async def query(model: str):
+        wants_title = request_title and model == COUNCIL_MODELS[0]
+        if wants_title:
+            # Same prompt with the title instruction prepended
+            model_messages = history + [{"role": "user", "content": f"{TITLE_INSTRUCTION}\n\n{content}"}]
+            model_json = encode_messages(model_messages)
+        else:
+            model_messages, model_json = messages, messages_json
+
+        # Reuse cached answers to near-duplicate queries
+        response = await semantic_cache.get_or_query(
+            make_namespace(model, history, context, wants_title),
+            user_query,
+            lambda: query_model(model, model_messages, messages_json=model_json),
+            query_embedding
+        )
+        return model, wants_title, response
 
     # Query all models in parallel
-    responses = await query_models_parallel(COUNCIL_MODELS, messages)
+    tasks = [asyncio.create_task(query(model)) for model in COUNCIL_MODELS]
 
-    # Format results
-    stage1_results = []
-    for model, response in responses.items():
-        if response is not None:  # Only include successful responses
-            stage1_results.append({
-                "model": model,
-                "response": response.get('content', '')
-            })
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            model, wants_title, response = await next_done
+            if response is not None:  # Only include successful responses
+                result = {
+                    "model": model,
+                    "response": response.get('content') or ''
+                }
+                if wants_title:
+                    title, result["response"] = _extract_title(result["response"])
+                    if title:
+                        result["title"] = title
+                yield result
+    finally:
+        # Don't leave requests running if the consumer stops early
+        for task in tasks:
+            task.cancel()
 
-    return stage1_results
 
 
 
 
 
+def _extract_title(response: str) -> Tuple[Optional[str], str]:
+    """Split a <title>...</title> tag off a response, returning (title, body)."""
+    match = _TITLE_TAG_RE.search(response)
+    if match is None:
+        return None, response
 
-async def stage3_synthesize_final(
-    user_query: str,
-    stage1_results: List[Dict[str, Any]],
-    history: List[Dict[str, str]] = [],
-    context: str = ""
-) -> Dict[str, Any]:
-    """
-    Stage 3: Chairman synthesizes final response.
+    title = match.group(1).strip().strip('"\'')
+    body = (response[:match.start()] + response[match.end():]).strip()
+    return (_truncate_title(title) if title else None), body
 
-    Args:
-        user_query: The original user query
-        stage1_results: Individual model responses from Stage 1
-        history: Previous conversation history
-        context: RAG context string
+
+def _estimate_tokens(text: str) -> int:
+    # Rough estimate: ~4 characters per token
+    return len(text) // 4 + 1
+
+
+async def _compact_history(
+    history: List[Dict[str, str]]
+) -> Tuple[str, List[Dict[str, str]]]:
+    """
+    Keep the most recent history within HISTORY_TOKEN_BUDGET and summarize the rest.
 
     Returns:
-        Dict with 'model' and 'response' keys
+        Tuple of (summary of older turns or "", recent turns to include verbatim)
+    """
+    split = len(history)
+    used = 0
+    while split > 0:
+        cost = _estimate_tokens(history[split - 1]["content"])
+        if used + cost > HISTORY_TOKEN_BUDGET:
+            break
+        used += cost
+        split -= 1
+
+    older, recent = history[:split], history[split:]
+    if not older:
+        return "", recent
+
+    return await _summarize_history(older), recent
+
+
+async def _summarize_history(older: List[Dict[str, str]]) -> str:
+    """
+    Summarize older turns, extending the longest already-summarized prefix.
+
+    Each turn that drops out of the budget costs one short summary call
+    instead of re-summarizing the whole conversation.
     """
+    # Running digests of every prefix of the older turns
+    hasher = hashlib.blake2b(digest_size=16)
+    digests = []
+    for msg in older:
+        hasher.update(json.dumps([msg["role"], msg["content"]]).encode("utf-8"))
+        digests.append(hasher.hexdigest())
+
+    if digests[-1] in _history_summaries:
+        _history_summaries.move_to_end(digests[-1])
+        return _history_summaries[digests[-1]]
+
+    previous_summary = ""
+    start = 0
+    for i in range(len(digests) - 2, -1, -1):
+        if digests[i] in _history_summaries:
+            previous_summary = _history_summaries[digests[i]]
+            start = i + 1
+            break
+
+    turns_text = "".join(
+        f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}\n"
+        for msg in older[start:]
+    )
+    summary_so_far = ""
+    if previous_summary:
+        summary_so_far = f"Summary so far: {previous_summary}\n\n"
+
+    summary_prompt = f"""Summarize the following conversation in a short paragraph. Keep the facts, decisions and open questions that later messages may refer to.
+
+{summary_so_far}{turns_text}
+Summary:"""
+
+    messages = [{"role": "user", "content": summary_prompt}]
+    response = await query_model(COUNCIL_MODELS[0], messages, timeout=30.0)
+
+    if response is None or not response.get('content'):
+        # Drop the older turns rather than blow the prompt budget
+        return previous_summary
+
+    summary = response['content'].strip()
+    _history_summaries[digests[-1]] = summary
+    while len(_history_summaries) > HISTORY_SUMMARY_CACHE_SIZE:
+        _history_summaries.popitem(last=False)
+    return summary
+
+
+def _build_chairman_prompt(
+    user_query: str,
+    stage1_results: List[Dict[str, Any]],
+    history: List[Dict[str, str]],
+    context: str,
+    history_summary: str = ""
+) -> str:
+    """Build the Stage 3 prompt asking the chairman to synthesize all responses."""
     # Build comprehensive context for chairman
     stage1_text = "\n\n".join([
         f"Model: {result['model']}\nResponse: {result['response']}"
@@ -74,37 +236,67 @@ async def stage3_synthesize_final(
 
     # Format history for context if present
     history_text = ""
-    if history:
-        history_text = "\n\nConversation Context:\n"
-        for msg in history:
-            role = "User" if msg["role"] == "user" else "Assistant"
-            history_text += f"{role}: {msg['content']}\n"
-        history_text += "\n"
+    if history or history_summary:
+        history_parts = ["\n\nConversation Context:\n"]
+        if history_summary:
+            history_parts.append(f"Summary of earlier conversation: {history_summary}\n")
+        history_parts.extend(
+            f"{'User' if msg['role'] == 'user' else 'Assistant'}: {msg['content']}\n"
+            for msg in history
+        )
+        history_parts.append("\n")
+        history_text = "".join(history_parts)
 
     # Format rag context
     rag_text = ""
     if context:
         rag_text = f"\n\nReference Documents:\n{context}\n"
 
-    chairman_prompt = f"""You are the Chairman of an LLM Council. Multiple AI models have provided responses to a user's question.
+    return "".join((
+        _CHAIRMAN_PREAMBLE_HEAD,
+        rag_text,
+        "\n",
+        history_text,
+        "Original Question: ",
+        user_query,
+        "\n\nSTAGE 1 - Individual Responses:\n",
+        stage1_text,
+        _CHAIRMAN_PREAMBLE_TAIL,
+    ))
 
-{rag_text}
-{history_text}Original Question: {user_query}
 
-STAGE 1 - Individual Responses:
-{stage1_text}
+async def stage3_synthesize_final(
+    user_query: str,
+    stage1_results: List[Dict[str, Any]],
+    history: List[Dict[str, str]] = [],
+    context: str = ""
+) -> Dict[str, Any]:
+    """
+    Stage 3: Chairman synthesizes final response.
 
-Your task as Chairman is to synthesize all of this information into a single, comprehensive, accurate answer to the user's original question. Consider:
-- The individual responses and their insights
-- Any patterns of agreement or disagreement
+    Args:
+        user_query: The original user query
+        stage1_results: Individual model responses from Stage 1
+        history: Previous conversation history
+        context: RAG context string
 
-Provide a clear, well-reasoned final answer that represents the council's collective wisdom:"""
+    Returns:
+        Dict with 'model' and 'response' keys
+    """
+    history_summary, recent_history = await _compact_history(history)
+    chairman_prompt = _build_chairman_prompt(
+        user_query, stage1_results, recent_history, context, history_summary
+    )
 
     messages = [{"role": "user", "content": chairman_prompt}]
 
-    # Query the chairman model
+    # Query the chairman model, reusing a cached synthesis for near-duplicate queries
     try:
-        response = await query_model(CHAIRMAN_MODEL, messages)
+        response = await semantic_cache.get_or_query(
+            make_namespace(CHAIRMAN_MODEL, history, context, stage1_results),
+            user_query,
+            lambda: query_model(CHAIRMAN_MODEL, messages)
+        )
     except Exception as e:
         print(f"Error querying chairman model: {e}")
         response = None
@@ -113,7 +305,7 @@ Provide a clear, well-reasoned final answer that represents the council's collec
         # Fallback if chairman fails
         return {
             "model": CHAIRMAN_MODEL,
-            "response": "The Chairman model is currently unavailable or encountered an error. Please refer to the council member responses above."
+            "response": CHAIRMAN_UNAVAILABLE_RESPONSE
         }
 
 
@@ -137,39 +329,10 @@ async def stage3_synthesize_final_stream(
     """
     from .openrouter import query_model_stream
     
-    # Build comprehensive context for chairman
-    stage1_text = "\n\n".join([
-        f"Model: {result['model']}\nResponse: {result['response']}"
-        for result in stage1_results
-    ])
-
-    # Format history for context if present
-    history_text = ""
-    if history:
-        history_text = "\n\nConversation Context:\n"
-        for msg in history:
-            role = "User" if msg["role"] == "user" else "Assistant"
-            history_text += f"{role}: {msg['content']}\n"
-        history_text += "\n"
-
-    # Format rag context
-    rag_text = ""
-    if context:
-        rag_text = f"\n\nReference Documents:\n{context}\n"
-
-    chairman_prompt = f"""You are the Chairman of an LLM Council. Multiple AI models have provided responses to a user's question.
-
-{rag_text}
-{history_text}Original Question: {user_query}
-
-STAGE 1 - Individual Responses:
-{stage1_text}
-
-Your task as Chairman is to synthesize all of this information into a single, comprehensive, accurate answer to the user's original question. Consider:
-- The individual responses and their insights
-- Any patterns of agreement or disagreement
-
-Provide a clear, well-reasoned final answer that represents the council's collective wisdom:"""
+    history_summary, recent_history = await _compact_history(history)
+    chairman_prompt = _build_chairman_prompt(
+        user_query, stage1_results, recent_history, context, history_summary
+    )
 
     messages = [{"role": "user", "content": chairman_prompt}]
 
@@ -197,6 +360,12 @@ async def generate_conversation_title(user_query: str) -> str:
     Returns:
         A short title (3-5 words)
     """
+    # Derive the title locally from the leading content words when possible
+    title = local_conversation_title(user_query)
+    if title:
+        return title
+
+    # Too little to go on, ask a model instead
     title_prompt = f"""Generate a very short title (3-5 words maximum) that summarizes the following question.
 The title should be concise and descriptive. Do not use quotes or punctuation in the title.
 
@@ -215,9 +384,22 @@ Title:"""
 
     title = response.get('content', 'New Conversation').strip()
 
-    # Clean up the title - remove quotes, limit length
+    # Clean up the title - remove quotes
     title = title.strip('"\'')
 
+    return _truncate_title(title)
+
+
+def local_conversation_title(user_query: str) -> Optional[str]:
+    """Build a title from the leading content words of a message, or None if too few."""
+    words = re.findall(r"\w+", user_query)[:8]
+    kept = [word for word in words if word.lower() not in TITLE_STOPWORDS][:5]
+    if len(kept) < 2:
+        return None
+    return _truncate_title(" ".join(word[:1].upper() + word[1:] for word in kept))
+
+
+def _truncate_title(title: str) -> str:
     # Truncate if too long
     if len(title) > 50:
         title = title[:47] + "..."
@@ -242,7 +424,9 @@ async def run_full_council(
         Tuple of (stage1_results, stage3_result)
     """
     # Stage 1: Collect individual responses
-    stage1_results = await stage1_collect_responses(user_query, history, context)
+    stage1_results = [
+        result async for result in stage1_collect_responses(user_query, history, context)
+    ]
 
     # If no models responded successfully, return error
     if not stage1_results:
@@ -3,10 +3,14 @@
 import os
 import json
 from datetime import datetime
+import orjson
+import zstandard
 from typing import Any, List, Optional
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy import Column, Integer, String, Text, DateTime, JSON
+from sqlalchemy.orm import sessionmaker, declarative_base, relationship, deferred
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index, LargeBinary, event
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 from .config import DATA_DIR
 
@@ -19,14 +23,75 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     DATABASE_URL = f"sqlite+aiosqlite:///{os.path.join(DATA_DIR, 'council.db')}"
 
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+# SQLite pragmas applied to every new connection: WAL lets reads proceed
+# during writes, NORMAL sync is durable under WAL without fsync per commit
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+]
+
 # SQLAlchemy setup
-engine = create_async_engine(DATABASE_URL, echo=False)
+if IS_SQLITE:
+    engine = create_async_engine(
+        DATABASE_URL,
+        echo=False,
+        # Writers wait up to 30 s for the lock (sets SQLite's busy timeout)
+        connect_args={"timeout": 30},
+        poolclass=AsyncAdaptedQueuePool,
+        pool_size=10,
+        max_overflow=0,
+    )
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+else:
+    connect_args = {}
+    if DATABASE_URL.startswith("postgresql+asyncpg"):
+        # SQLAlchemy prepares every statement and keeps them in its own
+        # per-connection LRU (default 100); keep more for the repeated queries
+        connect_args["prepared_statement_cache_size"] = 1024
+    engine = create_async_engine(
+        DATABASE_URL,
+        echo=False,
+        pool_size=20,
+        max_overflow=10,
+        pool_pre_ping=False,
+        connect_args=connect_args,
+    )
 AsyncSessionLocal = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
 Base = declarative_base()
 
 
+class CompressedJsonType(TypeDecorator):
+    """JSON serialized with orjson and stored zstd-compressed as binary."""
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return zstandard.compress(orjson.dumps(value))
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            # Rows written before compression hold plain JSON text
+            return orjson.loads(value)
+        return orjson.loads(zstandard.decompress(value))
+
+
 class ConversationModel(Base):
     """Conversation database model."""
     __tablename__ = "conversations"
@@ -34,36 +99,53 @@ class ConversationModel(Base):
     id = Column(String, primary_key=True, index=True)
     title = Column(String, default="New Conversation")
     created_at = Column(DateTime, default=datetime.utcnow)
-    
-    # We could establish a relationship here, but for simplicity in this
-    # refactor phase, we'll just query messages by conversation_id manually
-    # or add the relationship if needed later on.
+
+    # Messages in display order, for eager loading. messages.conversation_id
+    # has no foreign key constraint, so the join is spelled out; messages are
+    # written through MessageModel directly, hence viewonly.
+    messages = relationship(
+        "MessageModel",
+        primaryjoin="ConversationModel.id == foreign(MessageModel.conversation_id)",
+        order_by="[MessageModel.created_at, MessageModel.id]",
+        viewonly=True,
+    )
 
 
 class MessageModel(Base):
     """Message database model."""
     __tablename__ = "messages"
+    __table_args__ = (
+        # History queries filter by conversation and order by time
+        Index("ix_messages_conv_created", "conversation_id", "created_at"),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
-    conversation_id = Column(String, index=True)
+    conversation_id = Column(String)
     role = Column(String)  # 'user' or 'assistant'
     content = Column(Text) # For user messages, simple text. For assistant, JSON string.
     created_at = Column(DateTime, default=datetime.utcnow)
     
-    # Metadata fields to store stage results as JSON
-    stage1_results = Column(JSON, nullable=True)
-    stage2_results = Column(JSON, nullable=True)
-    stage3_result = Column(JSON, nullable=True)
-    metadata_json = Column(JSON, nullable=True)
+    # Metadata fields to store stage results as compressed JSON. They are
+    # deferred, so they are only fetched by queries that undefer "stages".
+    stage1_results = deferred(Column(CompressedJsonType, nullable=True), group="stages")
+    stage2_results = deferred(Column(CompressedJsonType, nullable=True), group="stages")
+    stage3_result = deferred(Column(CompressedJsonType, nullable=True), group="stages")
+    metadata_json = deferred(Column(CompressedJsonType, nullable=True), group="stages")
 
 
 async def init_db():
     """Initialize the database tables."""
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        # create_all skips existing tables, so add indexes introduced later
+        for index in MessageModel.__table__.indexes:
+            await conn.run_sync(lambda sync_conn, index=index: index.create(sync_conn, checkfirst=True))
 
 
 async def get_db():
-    """Dependency for getting DB session."""
+    """
+    Dependency for getting DB session, shared by every storage call in a
+    request. Each storage call runs in its own short transaction.
+    """
     async with AsyncSessionLocal() as session:
         yield session
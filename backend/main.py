@@ -1,35 +1,159 @@
 """FastAPI backend for LLM Council."""
 
 import uuid
-import json
+import math
 import asyncio
+import hashlib
+from collections import OrderedDict
 from contextlib import asynccontextmanager
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Tuple
 
-from fastapi import FastAPI, HTTPException, UploadFile, File
+import orjson
+from fastapi import FastAPI, HTTPException, UploadFile, File, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from . import storage
+from .database import AsyncSessionLocal, get_db
+from .config import COUNCIL_MODELS
 from .rag import rag_engine
+from .openrouter import close_client
 from .council import (
     run_full_council, 
     generate_conversation_title, 
+    local_conversation_title,
     stage1_collect_responses, 
     stage1_collect_responses, 
     stage3_synthesize_final, 
-    stage3_synthesize_final_stream
+    stage3_synthesize_final_stream,
+    CHAIRMAN_UNAVAILABLE_RESPONSE
 )
 
 
+# Stage 3 chunks are coalesced into SSE events of at least this many
+# characters, or whatever arrived within this many seconds
+STREAM_FLUSH_CHARS = 64
+STREAM_FLUSH_INTERVAL = 0.016
+
+
+def sse_event(payload: Dict[str, Any]) -> bytes:
+    """Encode a payload as a Server-Sent Events data frame."""
+    return b"data: " + orjson.dumps(payload) + b"\n\n"
+
+
+async def coalesce_chunks(
+    chunks: AsyncIterator[str],
+    max_chars: int = STREAM_FLUSH_CHARS,
+    max_delay: float = STREAM_FLUSH_INTERVAL
+) -> AsyncIterator[str]:
+    """
+    Merge small text chunks so each SSE event carries more than one token.
+
+    A buffer is flushed once it reaches max_chars or max_delay seconds after
+    its first chunk arrived, whichever comes first, so slow streams still
+    update promptly.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = chunks.__aiter__()
+    buffer: List[str] = []
+    buffered_chars = 0
+    deadline = 0.0
+    pending = None
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+
+            timeout = max(0.0, deadline - loop.time()) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+
+            if not done:
+                # Time window elapsed with no new chunk
+                yield "".join(buffer)
+                buffer, buffered_chars = [], 0
+                continue
+
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                pending = None
+                break
+            pending = None
+
+            if not buffer:
+                deadline = loop.time() + max_delay
+            buffer.append(chunk)
+            buffered_chars += len(chunk)
+
+            if buffered_chars >= max_chars:
+                yield "".join(buffer)
+                buffer, buffered_chars = [], 0
+
+        if buffer:
+            yield "".join(buffer)
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+# RAG search results keyed by (conversation_id, query digest, k)
+RAG_CACHE_SIZE = 512
+_rag_cache: "OrderedDict[Tuple[str, bytes, int], List[Dict[str, Any]]]" = OrderedDict()
+
+
+def search_documents(conversation_id: str, query: str, k: int = 3) -> List[Dict[str, Any]]:
+    """Search the conversation's RAG documents, reusing results for repeated queries."""
+    key = (conversation_id, hashlib.blake2b(query.encode("utf-8"), digest_size=16).digest(), k)
+    if key in _rag_cache:
+        _rag_cache.move_to_end(key)
+        return _rag_cache[key]
+
+    docs = rag_engine.search(conversation_id, query, k=k)
+    _rag_cache[key] = docs
+    while len(_rag_cache) > RAG_CACHE_SIZE:
+        _rag_cache.popitem(last=False)
+    return docs
+
+
+def invalidate_rag_cache(conversation_id: str):
+    """Drop cached search results after the conversation's documents change."""
+    for key in [key for key in _rag_cache if key[0] == conversation_id]:
+        del _rag_cache[key]
+
+
+# Start the chairman once this many council members have answered
+STAGE3_QUORUM = math.ceil(len(COUNCIL_MODELS) / 2)
+
+# Marks the end of a source in pump_into()
+_STREAM_DONE = object()
+
+
+async def pump_into(queue: asyncio.Queue, name: str, source: AsyncIterator[Any]):
+    """
+    Forward items from an async iterator into a shared queue as (name, item).
+
+    Ends with (name, _STREAM_DONE), or (name, exception) if the source failed,
+    so a single consumer can interleave several concurrent streams.
+    """
+    try:
+        async for item in source:
+            await queue.put((name, item))
+    except Exception as e:
+        await queue.put((name, e))
+        return
+    await queue.put((name, _STREAM_DONE))
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     await storage.initialize_storage()
     yield
     # Shutdown
-    pass
+    await close_client()
 
 
 app = FastAPI(title="LLM Council API", lifespan=lifespan)
@@ -77,39 +201,48 @@ async def root():
 
 
 @app.get("/api/conversations", response_model=List[ConversationMetadata])
-async def list_conversations():
+async def list_conversations(session: AsyncSession = Depends(get_db)):
     """List all conversations (metadata only)."""
-    return await storage.list_conversations()
+    return await storage.list_conversations(session)
 
 
 @app.post("/api/conversations", response_model=Conversation)
-async def create_conversation(request: CreateConversationRequest = None):
+async def create_conversation(
+    request: CreateConversationRequest = None,
+    session: AsyncSession = Depends(get_db)
+):
     """Create a new conversation."""
     conversation_id = str(uuid.uuid4())
-    conversation = await storage.create_conversation(conversation_id)
+    conversation = await storage.create_conversation(session, conversation_id)
     return conversation
 
 
 @app.get("/api/conversations/{conversation_id}", response_model=Conversation)
-async def get_conversation(conversation_id: str):
+async def get_conversation(conversation_id: str, session: AsyncSession = Depends(get_db)):
     """Get a specific conversation with all its messages."""
-    conversation = await storage.get_conversation(conversation_id)
+    conversation = await storage.get_conversation(session, conversation_id)
     if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
     return conversation
 
 
 @app.post("/api/conversations/{conversation_id}/upload")
-async def upload_file(conversation_id: str, file: UploadFile = File(...)):
+async def upload_file(
+    conversation_id: str,
+    file: UploadFile = File(...),
+    session: AsyncSession = Depends(get_db)
+):
     """Upload a file for RAG context."""
     # Check if conversation exists
-    conversation = await storage.get_conversation(conversation_id)
-    if conversation is None:
+    message_count = await storage.conversation_exists_and_count(session, conversation_id)
+    if message_count is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
         
     try:
         content = await file.read()
-        result = rag_engine.process_file(conversation_id, content, file.filename)
+        # Extraction and embedding block, so keep them off the event loop
+        result = await asyncio.to_thread(rag_engine.process_file, conversation_id, content, file.filename)
+        invalidate_rag_cache(conversation_id)
         if "error" in result:
              raise HTTPException(status_code=400, detail=result["error"])
         return result
@@ -117,16 +250,39 @@ async def upload_file(conversation_id: str, file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/conversations/{conversation_id}/uploads")
+async def upload_files(
+    conversation_id: str,
+    files: List[UploadFile] = File(...),
+    session: AsyncSession = Depends(get_db)
+):
+    """Upload several files for RAG context, embedded together in one batch."""
+    # Check if conversation exists
+    message_count = await storage.conversation_exists_and_count(session, conversation_id)
+    if message_count is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    try:
+        contents = [(file.filename, await file.read()) for file in files]
+        # Extraction and embedding block, so keep them off the event loop
+        results = await asyncio.to_thread(rag_engine.process_files, conversation_id, contents)
+        invalidate_rag_cache(conversation_id)
+        return {"files": results}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.delete("/api/conversations/{conversation_id}/files/{filename}")
-async def delete_file(conversation_id: str, filename: str):
+async def delete_file(conversation_id: str, filename: str, session: AsyncSession = Depends(get_db)):
     """Remove a file from RAG context."""
     # Check if conversation exists
-    conversation = await storage.get_conversation(conversation_id)
-    if conversation is None:
+    message_count = await storage.conversation_exists_and_count(session, conversation_id)
+    if message_count is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
         
     try:
         success = rag_engine.remove_file(conversation_id, filename)
+        invalidate_rag_cache(conversation_id)
         if not success:
              raise HTTPException(status_code=404, detail="File not found in context")
         return {"status": "success", "filename": filename}
@@ -137,32 +293,33 @@ async def delete_file(conversation_id: str, filename: str):
 
 
 @app.post("/api/conversations/{conversation_id}/message")
-async def send_message(conversation_id: str, request: SendMessageRequest):
+async def send_message(
+    conversation_id: str,
+    request: SendMessageRequest,
+    session: AsyncSession = Depends(get_db)
+):
     """
     Send a message and run the council process.
     Returns the complete response with all stages.
     """
     # Check if conversation exists
-    conversation = await storage.get_conversation(conversation_id)
-    if conversation is None:
+    message_count = await storage.conversation_exists_and_count(session, conversation_id)
+    if message_count is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
     # Check if this is the first message
-    is_first_message = len(conversation["messages"]) == 0
+    is_first_message = message_count == 0
 
     # Get history for context (before adding new message)
-    history = await storage.get_chat_history(conversation_id)
-
-    # Add user message
-    await storage.add_user_message(conversation_id, request.content)
+    history = await storage.get_chat_history(session, conversation_id)
 
     # If this is the first message, generate a title
     if is_first_message:
         title = await generate_conversation_title(request.content)
-        await storage.update_conversation_title(conversation_id, title)
+        await storage.update_conversation_title(session, conversation_id, title)
 
     # RAG Retrieval
-    docs = rag_engine.search(conversation_id, request.content, k=3)
+    docs = search_documents(conversation_id, request.content, k=3)
     context = ""
     if docs:
         context = "\n\n".join([f"Source: {d['source']}\nContent: {d['text']}" for d in docs])
@@ -174,9 +331,11 @@ async def send_message(conversation_id: str, request: SendMessageRequest):
         context
     )
 
-    # Add assistant message with results
-    await storage.add_assistant_message(
+    # Save the user message and assistant reply together
+    await storage.add_turn(
+        session,
         conversation_id,
+        request.content,
         stage1_results,
         [], # No stage 2
         stage3_result,
@@ -194,72 +353,124 @@ async def send_message(conversation_id: str, request: SendMessageRequest):
 
 
 @app.post("/api/conversations/{conversation_id}/message/stream")
-async def send_message_stream(conversation_id: str, request: SendMessageRequest):
+async def send_message_stream(
+    conversation_id: str,
+    request: SendMessageRequest,
+    session: AsyncSession = Depends(get_db)
+):
     """
     Send a message and stream the 3-stage council process.
     Returns Server-Sent Events as each stage completes.
     """
     # Check if conversation exists
-    conversation = await storage.get_conversation(conversation_id)
-    if conversation is None:
+    message_count = await storage.conversation_exists_and_count(session, conversation_id)
+    if message_count is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
     # Check if this is the first message
-    is_first_message = len(conversation["messages"]) == 0
+    is_first_message = message_count == 0
 
     async def event_generator():
+        # The request's session can be closed before the stream finishes,
+        # so the stream opens its own
+        stream_session = AsyncSessionLocal()
         try:
             # Get history for context (before adding new message)
-            history = await storage.get_chat_history(conversation_id)
+            history = await storage.get_chat_history(stream_session, conversation_id)
 
             # Add user message
-            await storage.add_user_message(conversation_id, request.content)
-
-            # Start title generation in parallel (don't await yet)
-            title_task = None
-            if is_first_message:
-                title_task = asyncio.create_task(generate_conversation_title(request.content))
+            await storage.add_user_message(stream_session, conversation_id, request.content)
 
             # RAG Retrieval
-            docs = rag_engine.search(conversation_id, request.content, k=3)
+            docs = search_documents(conversation_id, request.content, k=3)
             context = ""
             if docs:
                 context = "\n\n".join([f"Source: {d['source']}\nContent: {d['text']}" for d in docs])
                 # Send context event for UI
-                yield f"data: {json.dumps({'type': 'rag_context', 'data': docs})}\n\n"
-
-            # Stage 1: Collect responses
-            yield f"data: {json.dumps({'type': 'stage1_start'})}\n\n"
-            stage1_results = await stage1_collect_responses(request.content, history, context)
-            yield f"data: {json.dumps({'type': 'stage1_complete', 'data': stage1_results})}\n\n"
-
-
-            # Stage 3: Synthesize final answer (with streaming)
-            yield f"data: {json.dumps({'type': 'stage3_start'})}\n\n"
-            
-            full_response = ""
-            async for chunk in stage3_synthesize_final_stream(request.content, stage1_results, history, context):
-                full_response += chunk
-                yield f"data: {json.dumps({'type': 'stage3_chunk', 'chunk': chunk})}\n\n"
-            
-            stage3_result = {
-                "model": "chairman", # Should be CHAIRMAN_MODEL constant, but handled by logic
-                "response": full_response
-            }
-            yield f"data: {json.dumps({'type': 'stage3_complete', 'data': stage3_result})}\n\n"
-
-            # Wait for title generation if it was started
-            if title_task:
-                # Give it a timeout so it doesn't block forever if stuck
-                try:
-                    title = await asyncio.wait_for(title_task, timeout=5.0)
-                    await storage.update_conversation_title(conversation_id, title)
-                    yield f"data: {json.dumps({'type': 'title_complete', 'data': {'title': title}})}\n\n"
-                except Exception as e:
-                    print(f"Title generation failed or timed out: {e}")
+                yield sse_event({'type': 'rag_context', 'data': docs})
+
+            # Stage 1 and Stage 3 run concurrently: the chairman starts drafting
+            # as soon as a quorum of council members has answered
+            yield sse_event({'type': 'stage1_start'})
+            queue: asyncio.Queue = asyncio.Queue()
+            pumps = [asyncio.create_task(pump_into(
+                queue, "stage1", stage1_collect_responses(
+                    request.content, history, context, request_title=is_first_message
+                )
+            ))]
+            running = {"stage1"}
+            stage1_results = []
+            title = None
+            draft_inputs = None
+            draft_chunks = []
+
+            try:
+                while True:
+                    if draft_inputs is None and stage1_results and (
+                        len(stage1_results) >= STAGE3_QUORUM or "stage1" not in running
+                    ):
+                        # Stage 3: Synthesize a draft answer (with streaming)
+                        draft_inputs = list(stage1_results)
+                        yield sse_event({'type': 'stage3_start'})
+                        pumps.append(asyncio.create_task(pump_into(
+                            queue, "stage3", coalesce_chunks(
+                                stage3_synthesize_final_stream(request.content, draft_inputs, history, context)
+                            )
+                        )))
+                        running.add("stage3")
+
+                    if not running:
+                        break
+
+                    name, item = await queue.get()
+                    if item is _STREAM_DONE:
+                        running.discard(name)
+                        if name == "stage1":
+                            yield sse_event({'type': 'stage1_complete', 'data': stage1_results})
+                        else:
+                            # The draft is done; don't wait for slower council members
+                            stage3_result = {
+                                "model": "chairman", # Should be CHAIRMAN_MODEL constant, but handled by logic
+                                "response": "".join(draft_chunks)
+                            }
+                            yield sse_event({'type': 'stage3_complete', 'data': stage3_result})
+                    elif isinstance(item, Exception):
+                        raise item
+                    elif name == "stage1":
+                        # The first council model titles new conversations
+                        title = item.pop("title", None) or title
+                        stage1_results.append(item)
+                        yield sse_event({'type': 'stage1_model', 'data': item})
+                    else:
+                        draft_chunks.append(item)
+                        yield sse_event({'type': 'stage3_chunk', 'chunk': item})
+            finally:
+                for pump in pumps:
+                    pump.cancel()
+
+            if draft_inputs is None:
+                # No council member responded, so there is nothing to synthesize
+                stage3_result = {
+                    "model": "error",
+                    "response": "All models failed to respond. Please try again."
+                }
+                yield sse_event({'type': 'stage3_complete', 'data': stage3_result})
+            elif len(stage1_results) > len(draft_inputs):
+                # Responses that arrived after the draft started get a second pass
+                revision = await stage3_synthesize_final(request.content, stage1_results, history, context)
+                if revision["response"] != CHAIRMAN_UNAVAILABLE_RESPONSE:
+                    stage3_result = revision
+                    yield sse_event({'type': 'stage3_revision', 'data': stage3_result})
+
+            # Title came back with Stage 1; fall back to the local heuristic
+            if is_first_message:
+                title = title or local_conversation_title(request.content) or "New Conversation"
+                await storage.update_conversation_title(stream_session, conversation_id, title)
+                yield sse_event({'type': 'title_complete', 'data': {'title': title}})
 
             # Save complete assistant message
             await storage.add_assistant_message(
+                stream_session,
                 conversation_id,
                 stage1_results,
                 [], # No stage 2
@@ -268,12 +479,14 @@ async def send_message_stream(conversation_id: str, request: SendMessageRequest)
             )
 
             # Send completion event
-            yield f"data: {json.dumps({'type': 'complete'})}\n\n"
+            yield sse_event({'type': 'complete'})
 
         except Exception as e:
             # Send error event
             print(f"Error in stream: {e}")
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
+            yield sse_event({'type': 'error', 'message': str(e)})
+        finally:
+            await stream_session.close()
 
     return StreamingResponse(
         event_generator(),
@@ -287,4 +500,14 @@ async def send_message_stream(conversation_id: str, request: SendMessageRequest)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
+    # httptools parser and uvloop event loop (both installed by uvicorn[standard];
+    # "auto" falls back to asyncio where uvloop is unavailable, e.g. Windows).
+    # Keep idle connections open longer than typical proxy timeouts.
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8001,
+        loop="auto",
+        http="httptools",
+        timeout_keep_alive=75,
+    )
@@ -1,31 +1,165 @@
 """OpenRouter API client for making LLM requests."""
 
 import httpx
-import json
+import orjson
 import asyncio
+import hashlib
 import random
-from typing import List, Dict, Any, Optional
-from .config import OPENROUTER_API_KEY, OPENROUTER_API_URL
+import re
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, AsyncIterator
+from .config import (
+    OPENROUTER_API_KEY,
+    OPENROUTER_API_URL,
+    CONCURRENCY_LIMIT,
+    PROVIDER_CONCURRENCY_LIMITS,
+    OPENROUTER_RPM,
+    OPENROUTER_TPM,
+)
+from .ratelimit import TokenBucket
 
 # Constants for rate limiting
 MAX_RETRIES = 3
 BACKOFF_FACTOR = 2
-CONCURRENCY_LIMIT = 2
 
-# Global semaphore for rate limiting (lazy loaded)
-_semaphore = None
+# Connection pool and timeouts for the shared HTTP client
+MAX_CONNECTIONS = 64
+MAX_KEEPALIVE_CONNECTIONS = 32
+KEEPALIVE_EXPIRY = 120.0
+CONNECT_TIMEOUT = 10.0
+WRITE_TIMEOUT = 10.0
+POOL_TIMEOUT = 5.0
 
-def get_semaphore():
-    global _semaphore
-    if _semaphore is None:
-        _semaphore = asyncio.Semaphore(CONCURRENCY_LIMIT)
-    return _semaphore
+# Request bodies are pre-encoded, so set the content type explicitly
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Exact-match response cache
+EXACT_CACHE_SIZE = 4096
+STREAM_REPLAY_CHUNK_SIZE = 64
+
+# Matches the delta text in a streamed chunk, e.g. "content":"Hel\"lo"
+_CONTENT_RE = re.compile(rb'"content"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+# Per-provider semaphores for rate limiting (lazy loaded)
+_semaphores: Dict[str, asyncio.Semaphore] = {}
+
+# Per-provider request and token buckets (lazy loaded)
+_request_limiters: Dict[str, TokenBucket] = {}
+_token_limiters: Dict[str, TokenBucket] = {}
+
+# Shared HTTP client so connections are pooled across requests (lazy loaded)
+_client: Optional[httpx.AsyncClient] = None
+
+# Maps a hash of (model, serialized messages) to a successful response dict
+_exact_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+def get_semaphore(model: str) -> asyncio.Semaphore:
+    """Get the concurrency semaphore for the provider of a model (e.g. "openai")."""
+    provider = model.split("/")[0]
+    if provider not in _semaphores:
+        limit = PROVIDER_CONCURRENCY_LIMITS.get(provider, CONCURRENCY_LIMIT)
+        _semaphores[provider] = asyncio.Semaphore(limit)
+    return _semaphores[provider]
+
+
+async def _throttle(model: str, messages_json: bytes):
+    """Wait for request and token budget for the model's provider before sending."""
+    provider = model.split("/")[0]
+
+    if OPENROUTER_RPM > 0:
+        if provider not in _request_limiters:
+            _request_limiters[provider] = TokenBucket(OPENROUTER_RPM, 60.0)
+        await _request_limiters[provider].acquire()
+
+    if OPENROUTER_TPM > 0:
+        if provider not in _token_limiters:
+            _token_limiters[provider] = TokenBucket(OPENROUTER_TPM, 60.0)
+        # Rough estimate: ~4 characters per token
+        estimated_tokens = len(messages_json) // 4
+        await _token_limiters[provider].acquire(max(estimated_tokens, 1))
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Get the shared OpenRouter client.
+
+    HTTP/2 lets parallel council queries share one multiplexed connection.
+    """
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            http2=True,
+            timeout=_request_timeout(120.0),
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=KEEPALIVE_EXPIRY
+            ),
+            headers={"Authorization": f"Bearer {OPENROUTER_API_KEY}"}
+        )
+    return _client
+
+
+async def close_client():
+    """Close the shared client and its pooled connections."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _request_timeout(read_timeout: float) -> httpx.Timeout:
+    return httpx.Timeout(
+        connect=CONNECT_TIMEOUT,
+        read=read_timeout,
+        write=WRITE_TIMEOUT,
+        pool=POOL_TIMEOUT
+    )
+
+
+def encode_messages(messages: List[Dict[str, str]]) -> bytes:
+    """
+    Serialize messages once as the `"messages":[...]` member of a request body.
+
+    The result can be passed to several query_model calls so a large prompt
+    (history, RAG context) isn't re-encoded for every council member.
+    """
+    return orjson.dumps({"messages": messages})[1:-1]
+
+
+def _request_body(model: str, messages_json: bytes, stream: bool = False) -> bytes:
+    body = b'{"model":' + orjson.dumps(model) + b"," + messages_json
+    if stream:
+        body += b',"stream":true'
+    return body + b"}"
+
+
+def _cache_key(model: str, messages_json: bytes) -> str:
+    hasher = hashlib.blake2b(model.encode("utf-8"), digest_size=32)
+    hasher.update(b"\0")
+    hasher.update(messages_json)
+    return hasher.hexdigest()
+
+
+def _cache_get(key: str) -> Optional[Dict[str, Any]]:
+    response = _exact_cache.get(key)
+    if response is not None:
+        _exact_cache.move_to_end(key)
+    return response
+
+
+def _cache_put(key: str, response: Dict[str, Any]):
+    _exact_cache[key] = response
+    _exact_cache.move_to_end(key)
+    while len(_exact_cache) > EXACT_CACHE_SIZE:
+        _exact_cache.popitem(last=False)
 
 
 async def query_model(
     model: str,
     messages: List[Dict[str, str]],
-    timeout: float = 120.0
+    timeout: float = 120.0,
+    messages_json: Optional[bytes] = None
 ) -> Optional[Dict[str, Any]]:
     """
     Query a single model via OpenRouter API.
@@ -34,52 +168,58 @@ async def query_model(
         model: OpenRouter model identifier (e.g., "openai/gpt-4o")
         messages: List of message dicts with 'role' and 'content'
         timeout: Request timeout in seconds
+        messages_json: Pre-serialized messages from encode_messages()
 
     Returns:
         Response dict with 'content' and optional 'reasoning_details', or None if failed
     """
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-    }
+    if messages_json is None:
+        messages_json = encode_messages(messages)
 
-    payload = {
-        "model": model,
-        "messages": messages,
-    }
+    cache_key = _cache_key(model, messages_json)
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    body = _request_body(model, messages_json)
+
+    semaphore = get_semaphore(model)
 
-    semaphore = get_semaphore()
-    
     async with semaphore:
         for attempt in range(MAX_RETRIES + 1):
             try:
-                async with httpx.AsyncClient(timeout=timeout) as client:
-                    response = await client.post(
-                        OPENROUTER_API_URL,
-                        headers=headers,
-                        json=payload
-                    )
-                    
-                    if response.status_code == 429:
-                        # Rate limited
-                        if attempt < MAX_RETRIES:
-                            wait_time = (BACKOFF_FACTOR ** attempt) + random.uniform(0, 1)
-                            print(f"Rate limited (429) for {model}. Retrying in {wait_time:.2f}s...")
-                            await asyncio.sleep(wait_time)
-                            continue
-                        else:
-                            print(f"Max retries reached for {model} (429).")
-                            return None
-                            
-                    response.raise_for_status()
+                client = get_client()
+                await _throttle(model, messages_json)
+                response = await client.post(
+                    OPENROUTER_API_URL,
+                    content=body,
+                    headers=JSON_HEADERS,
+                    timeout=_request_timeout(timeout)
+                )
+                
+                if response.status_code == 429:
+                    # Rate limited
+                    if attempt < MAX_RETRIES:
+                        wait_time = (BACKOFF_FACTOR ** attempt) + random.uniform(0, 1)
+                        print(f"Rate limited (429) for {model}. Retrying in {wait_time:.2f}s...")
+                        await asyncio.sleep(wait_time)
+                        continue
+                    else:
+                        print(f"Max retries reached for {model} (429).")
+                        return None
+                        
+                response.raise_for_status()
 
-                    data = response.json()
-                    message = data['choices'][0]['message']
+                data = response.json()
+                message = data['choices'][0]['message']
 
-                    return {
-                        'content': message.get('content'),
-                        'reasoning_details': message.get('reasoning_details')
-                    }
+                result = {
+                    'content': message.get('content'),
+                    'reasoning_details': message.get('reasoning_details')
+                }
+                if result['content']:
+                    _cache_put(cache_key, result)
+                return result
 
             except httpx.HTTPStatusError as e:
                 # Other HTTP errors
@@ -92,30 +232,30 @@ async def query_model(
     return None
 
 
-async def query_models_parallel(
-    models: List[str],
-    messages: List[Dict[str, str]]
-) -> Dict[str, Optional[Dict[str, Any]]]:
-    """
-    Query multiple models in parallel.
+async def _iter_sse_data(response: httpx.Response) -> AsyncIterator[bytes]:
+    """Yield the payload of each `data:` line of a streaming response, as raw bytes."""
+    buffer = bytearray()
+    async for raw in response.aiter_bytes():
+        buffer.extend(raw)
+        start = 0
+        while (end := buffer.find(b"\n", start)) != -1:
+            line = bytes(buffer[start:end]).rstrip(b"\r")
+            start = end + 1
+            if line.startswith(b"data: "):
+                yield line[6:]
+        del buffer[:start]
 
-    Args:
-        models: List of OpenRouter model identifiers
-        messages: List of message dicts to send to each model
+    if buffer.startswith(b"data: "):
+        yield bytes(buffer[6:]).rstrip(b"\r")
 
-    Returns:
-        Dict mapping model identifier to response dict (or None if failed)
-    """
-    import asyncio
-
-    # Create tasks for all models
-    tasks = [query_model(model, messages) for model in models]
 
-    # Wait for all to complete
-    responses = await asyncio.gather(*tasks)
-
-    # Map models to their responses
-    return {model: response for model, response in zip(models, responses)}
+def _parse_delta_content(data: bytes) -> Optional[str]:
+    """Extract delta content from a chunk, avoiding a full JSON parse when possible."""
+    match = _CONTENT_RE.search(data)
+    if match:
+        # Decode only the string literal (handles escapes like \n and \u00e9)
+        return orjson.loads(b'"' + match.group(1) + b'"')
+    return orjson.loads(data)['choices'][0]['delta'].get('content')
 
 
 async def query_model_stream(
@@ -134,62 +274,68 @@ async def query_model_stream(
     Yields:
         String chunks of the response content
     """
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-    }
+    messages_json = encode_messages(messages)
+    cache_key = _cache_key(model, messages_json)
+    cached = _cache_get(cache_key)
+    if cached is not None:
+        # Replay the cached response in small slices to keep the streaming UX
+        content = cached.get('content') or ""
+        for i in range(0, len(content), STREAM_REPLAY_CHUNK_SIZE):
+            yield content[i:i + STREAM_REPLAY_CHUNK_SIZE]
+        return
 
-    payload = {
-        "model": model,
-        "messages": messages,
-        "stream": True # Enable streaming
-    }
+    body = _request_body(model, messages_json, stream=True)
 
     # Note: Scanning streaming responses for errors is tricky, 
     # but initial connection is covered here.
-    semaphore = get_semaphore()
+    semaphore = get_semaphore(model)
 
     async with semaphore:
         for attempt in range(MAX_RETRIES + 1):
             try:
-                async with httpx.AsyncClient(timeout=timeout) as client:
-                    async with client.stream(
-                        "POST", 
-                        OPENROUTER_API_URL, 
-                        headers=headers, 
-                        json=payload
-                    ) as response:
-                        
-                        if response.status_code == 429:
-                             if attempt < MAX_RETRIES:
-                                wait_time = (BACKOFF_FACTOR ** attempt) + random.uniform(0, 1)
-                                print(f"Rate limited (429) for {model} [stream]. Retrying in {wait_time:.2f}s...")
-                                await asyncio.sleep(wait_time)
-                                continue
-                             else:
-                                yield f"[ERROR: Rate limit exceeded for {model}]"
-                                return
-
-                        response.raise_for_status()
+                client = get_client()
+                await _throttle(model, messages_json)
+                async with client.stream(
+                    "POST", 
+                    OPENROUTER_API_URL, 
+                    content=body,
+                    headers=JSON_HEADERS,
+                    timeout=_request_timeout(timeout)
+                ) as response:
+                    
+                    if response.status_code == 429:
+                         if attempt < MAX_RETRIES:
+                            wait_time = (BACKOFF_FACTOR ** attempt) + random.uniform(0, 1)
+                            print(f"Rate limited (429) for {model} [stream]. Retrying in {wait_time:.2f}s...")
+                            await asyncio.sleep(wait_time)
+                            continue
+                         else:
+                            yield f"[ERROR: Rate limit exceeded for {model}]"
+                            return
+
+                    response.raise_for_status()
+                    
+                    chunks = []
+                    async for data in _iter_sse_data(response):
+                        if data.strip() == b"[DONE]":
+                            break
                         
-                        async for line in response.aiter_lines():
-                            if line.startswith("data: "):
-                                data_str = line[6:]
-                                if data_str.strip() == "[DONE]":
-                                    break
+                        try:
+                            content = _parse_delta_content(data)
+                            if content:
+                                chunks.append(content)
+                                yield content
+                        except orjson.JSONDecodeError:
+                            continue
+                    
+                    # If successful stream, cache it and break retry loop
+                    if chunks:
+                        _cache_put(cache_key, {
+                            'content': "".join(chunks),
+                            'reasoning_details': None
+                        })
+                    return
                                 
-                                try:
-                                    data = json.loads(data_str)
-                                    delta = data['choices'][0]['delta']
-                                    content = delta.get('content')
-                                    if content:
-                                        yield content
-                                except json.JSONDecodeError:
-                                    continue
-                        
-                        # If successful stream, break retry loop
-                        return
-                                    
             except Exception as e:
                 print(f"Error streaming model {model}: {e}")
                 if attempt == MAX_RETRIES:
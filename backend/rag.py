@@ -1,161 +1,566 @@
 
+import io
 import os
 import pickle
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import orjson
 import numpy as np
-from typing import List, Dict, Any
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
 from pathlib import Path
-from pypdf import PdfReader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
 
-from .config import DATA_DIR
+from .config import DATA_DIR, EMBEDDING_BACKEND, EMBEDDING_ONNX_FILE
+from . import _similarity
+from ._pdf import extract_pdf_text
+
+try:
+    # Optional SIMD similarity kernels (`uv sync --extra fast`)
+    import simsimd
+except ImportError:
+    simsimd = None
+
+try:
+    # Optional approximate nearest neighbour index (`uv sync --extra fast`)
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+# Per-conversation store files: row i of each .npy file belongs to line i of the JSONL file
+EMBEDDINGS_FILE = "embeddings.npy"
+EMBEDDINGS_I8_FILE = "embeddings_i8.npy"
+CHUNKS_FILE = "chunks.jsonl"
+INDEX_FILE = "index.hnsw"
+LEGACY_STORE_FILE = "store.pkl"
+
+# On-disk precision of the embeddings; float16 keeps plenty of precision for
+# cosine ranking at half the size of float32
+EMBEDDING_DTYPE = np.float16
+
+# Chunk length and overlap, in characters
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# Chunks per forward pass when embedding an upload
+EMBEDDING_BATCH_SIZE = 64
+EMBEDDING_BATCH_SIZE_GPU = 256
+
+# Stores with at least this many chunks are searched through an HNSW index;
+# below that a flat scan is faster
+HNSW_MIN_ELEMENTS = 1000
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+# Conversations whose loaded store is kept in memory
+STORE_CACHE_SIZE = 32
+
+# Worker processes for PDF text extraction when several PDFs arrive together
+PDF_WORKERS = min(4, os.cpu_count() or 1)
+
+# Process pool for PDF extraction (lazy loaded)
+_pdf_executor: Optional[ProcessPoolExecutor] = None
+
+def get_pdf_executor() -> ProcessPoolExecutor:
+    global _pdf_executor
+    if _pdf_executor is None:
+        # Spawned workers re-import the main module; that stays cheap because
+        # sentence-transformers and torch are only imported in get_embedding_model()
+        _pdf_executor = ProcessPoolExecutor(
+            max_workers=PDF_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pdf_executor
 
 # Global embedding model instance (lazy loaded)
 _embedding_model = None
+_embedding_model_lock = threading.Lock()
 
 def get_embedding_model():
     global _embedding_model
-    if _embedding_model is None:
-        # Use a small, fast model
-        _embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+    if _embedding_model is not None:
+        return _embedding_model
+    # Callers run in worker threads; load the model only once
+    with _embedding_model_lock:
+        if _embedding_model is not None:
+            return _embedding_model
+        import torch
+        from sentence_transformers import SentenceTransformer
+        # Let CPU inference use every core
+        torch.set_num_threads(os.cpu_count() or 1)
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        model = None
+        if EMBEDDING_BACKEND == 'onnx' and device == 'cpu':
+            try:
+                # Pre-exported, quantized graph from the model repo
+                model = SentenceTransformer(
+                    'all-MiniLM-L6-v2',
+                    backend='onnx',
+                    model_kwargs={"file_name": EMBEDDING_ONNX_FILE}
+                )
+            except Exception as e:
+                print(f"ONNX embedding backend unavailable, falling back to PyTorch: {e}")
+        if model is None:
+            # Use a small, fast model
+            model = SentenceTransformer('all-MiniLM-L6-v2', device=device)
+            if device == 'cuda':
+                # MiniLM tolerates FP16 well and it halves GPU memory traffic
+                model.half()
+        # Publish only once fully set up
+        _embedding_model = model
     return _embedding_model
 
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Scale each row to unit length, so cosine similarity becomes a dot product."""
+    # Row-wise sum of squares without linalg.norm's dispatch overhead
+    norms = np.sqrt(np.einsum("ij,ij->i", matrix, matrix))[:, None]
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, sorting only those k."""
+    if k >= len(scores):
+        return np.argsort(-scores)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+def _quantize_rows(matrix: np.ndarray) -> np.ndarray:
+    """Quantize each row to int8 with its own scale (cosine ignores per-row scale)."""
+    peaks = np.max(np.abs(matrix), axis=1, keepdims=True)
+    peaks[peaks == 0] = 1.0
+    return np.round(matrix * (127.0 / peaks)).astype(np.int8)
+
+def _append_npy_rows(path: Path, count: int, rows: np.ndarray):
+    """
+    Write rows after the first `count` rows of a 2-D .npy file.
+
+    Only the new rows and the header are written; NumPy pads headers so the
+    row count can grow in place.
+    """
+    if count == 0 or not path.exists():
+        np.save(path, rows)
+        return
+
+    with open(path, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+        data_offset = f.tell()
+
+        header = io.BytesIO()
+        header_data = {
+            "descr": np.lib.format.dtype_to_descr(dtype),
+            "fortran_order": False,
+            "shape": (count + len(rows), shape[1]),
+        }
+        if version == (1, 0):
+            np.lib.format.write_array_header_1_0(header, header_data)
+        else:
+            np.lib.format.write_array_header_2_0(header, header_data)
+        if header.tell() != data_offset:
+            # No room left in the header, rewrite the whole file
+            f.close()
+            existing = np.load(path)[:count]
+            np.save(path, np.vstack([existing, rows]))
+            return
+
+        # Rows first, then the header, so an interrupted write leaves the old shape intact
+        f.seek(data_offset + count * shape[1] * dtype.itemsize)
+        f.write(np.ascontiguousarray(rows, dtype=dtype).tobytes())
+        f.truncate()
+        f.flush()
+        f.seek(0)
+        f.write(header.getvalue())
+
+
+def _append_jsonl(path: Path, offset: int, records: List[Dict[str, Any]]) -> int:
+    """
+    Write records to a JSONL file starting at byte `offset`, the end of the
+    lines still in use, and return the new end.
+
+    Anything after `offset` (a partially written line, or lines whose vectors
+    were lost) is overwritten or truncated.
+    """
+    block = b"".join(orjson.dumps(record) + b"\n" for record in records)
+    with open(path, "r+b" if path.exists() else "w+b") as f:
+        f.seek(offset)
+        f.write(block)
+        f.truncate()
+    return offset + len(block)
+
+
+def _read_jsonl_lines(path: Path) -> List[bytes]:
+    with open(path, "rb") as f:
+        lines = f.read().split(b"\n")
+    # The last element is empty, or a partially written line
+    return lines[:-1]
+
+
 class RAGEngine:
     def __init__(self):
         self.rag_dir = Path(DATA_DIR) / "rag"
         self.rag_dir.mkdir(parents=True, exist_ok=True)
         self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
             length_function=len,
         )
+        # Loaded stores by conversation_id. The arrays and lists of a cached
+        # store are never mutated, writers replace the store, so searches can
+        # use them without the lock. The HNSW index is the exception: uploads
+        # grow it in place, so searches only accept ids below their row count.
+        self._stores: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.RLock()
 
     def _get_conv_dir(self, conversation_id: str) -> Path:
         path = self.rag_dir / conversation_id
         path.mkdir(parents=True, exist_ok=True)
         return path
 
-    def _get_store_path(self, conversation_id: str) -> Path:
-        return self._get_conv_dir(conversation_id) / "store.pkl"
 
     def process_file(self, conversation_id: str, file_content: bytes, filename: str) -> Dict[str, Any]:
         """
         Process an uploaded file: extract text, chunk, embed, and store.
         """
+        return self.process_files(conversation_id, [(filename, file_content)])[0]
+
+    def process_files(self, conversation_id: str, files: List[Tuple[str, bytes]]) -> List[Dict[str, Any]]:
+        """
+        Process several uploaded (filename, content) pairs at once.
+
+        PDFs are extracted in parallel worker processes, and the chunks of all
+        files are embedded together in one batched encode call.
+        """
         # 1. Extract text
-        text = ""
-        if filename.lower().endswith('.pdf'):
-            text = self._extract_pdf(file_content)
+        pdfs = [content for filename, content in files if filename.lower().endswith('.pdf')]
+        if len(pdfs) > 1:
+            pdf_texts = get_pdf_executor().map(extract_pdf_text, pdfs)
         else:
-            # Assume text/md
-            text = file_content.decode('utf-8', errors='ignore')
+            pdf_texts = map(extract_pdf_text, pdfs)
+        pdf_texts = iter(pdf_texts)
 
-        if not text.strip():
-            return {"error": "Empty file or could not extract text"}
+        results = []
+        all_chunks = []
+        sources = []
+        for filename, content in files:
+            if filename.lower().endswith('.pdf'):
+                text = next(pdf_texts)
+            else:
+                # Assume text/md
+                text = content.decode('utf-8', errors='ignore')
 
-        # 2. Split text
-        chunks = self.text_splitter.split_text(text)
-        
-        # 3. Embed
+            if not text.strip():
+                results.append({"filename": filename, "error": "Empty file or could not extract text"})
+                continue
+
+            # 2. Split text. PDFs keep structure-aware splitting; plain text is cut
+            # into fixed overlapping windows in a single pass
+            if filename.lower().endswith('.pdf'):
+                chunks = self.text_splitter.split_text(text)
+            else:
+                stride = CHUNK_SIZE - CHUNK_OVERLAP
+                chunks = [
+                    text[i:i + CHUNK_SIZE]
+                    for i in range(0, max(len(text) - CHUNK_OVERLAP, 1), stride)
+                ]
+            all_chunks.extend(chunks)
+            sources.extend([filename] * len(chunks))
+            results.append({"filename": filename, "chunks_count": len(chunks)})
+
+        if not all_chunks:
+            return results
+
+        # 3. Embed in one batched call; sentence-transformers groups chunks of
+        # similar length to cut padding. Rows come back L2-normalized so
+        # search is a single matmul.
         model = get_embedding_model()
-        embeddings = model.encode(chunks)
+        embeddings = model.encode(
+            all_chunks,
+            batch_size=EMBEDDING_BATCH_SIZE_GPU if model.device.type == 'cuda' else EMBEDDING_BATCH_SIZE,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        ).astype(np.float32, copy=False)  # FP16 on GPU
 
-        # 4. Update storage for this conversation
-        store = self._load_store(conversation_id)
-        
-        # Structure: list of dicts {'text': str, 'embedding': np.array, 'source': filename}
-        new_docs = []
-        for i, chunk in enumerate(chunks):
-            new_docs.append({
-                "text": chunk,
-                "embedding": embeddings[i],
-                "source": filename
-            })
-            
-        store["documents"].extend(new_docs)
-        self._save_store(conversation_id, store)
+        # 4. Append to storage for this conversation
+        embeddings_f16 = embeddings.astype(EMBEDDING_DTYPE)
+        embeddings_i8 = _quantize_rows(embeddings)
+        with self._lock:
+            store = self._load_store(conversation_id)
+            count = len(store["texts"])
+            conv_dir = self._get_conv_dir(conversation_id)
+            _append_npy_rows(conv_dir / EMBEDDINGS_FILE, count, embeddings_f16)
+            _append_npy_rows(conv_dir / EMBEDDINGS_I8_FILE, count, embeddings_i8)
+            chunks_end = _append_jsonl(conv_dir / CHUNKS_FILE, store["chunks_end"], [
+                {"text": chunk, "source": source} for chunk, source in zip(all_chunks, sources)
+            ])
+
+            # Keep the cached store in step with the files; map the grown files
+            # again rather than copying the old rows into memory
+            total_docs = count + len(all_chunks)
+            new_store = {
+                "matrix": np.load(conv_dir / EMBEDDINGS_FILE, mmap_mode='r')[:total_docs],
+                "matrix_i8": np.load(conv_dir / EMBEDDINGS_I8_FILE, mmap_mode='r')[:total_docs],
+                "texts": store["texts"] + all_chunks,
+                "sources": store["sources"] + sources,
+                "chunks_end": chunks_end,
+            }
+            if "matrix_f32" in store:
+                new_store["matrix_f32"] = np.concatenate([store["matrix_f32"], embeddings])
+            index = store.get("index")
+            if index is not None:
+                # Grow the existing index instead of rebuilding it
+                index.resize_index(total_docs)
+                index.add_items(embeddings, np.arange(count, count + len(all_chunks)))
+                index.save_index(str(conv_dir / INDEX_FILE))
+                new_store["index"] = index
+            self._cache_store(conversation_id, new_store)
         
-        return {
-            "filename": filename,
-            "chunks_count": len(chunks),
-            "total_docs": len(store["documents"])
-        }
+        for result in results:
+            if "error" not in result:
+                result["total_docs"] = total_docs
+        return results
 
     def remove_file(self, conversation_id: str, filename: str) -> bool:
         """
         Remove a file and its associated chunks from the store.
         """
-        store = self._load_store(conversation_id)
-        if not store["documents"]:
-            return False
+        with self._lock:
+            store = self._load_store(conversation_id)
+            if not store["texts"]:
+                return False
+                
+            # Keep rows whose source doesn't match
+            keep = [i for i, source in enumerate(store["sources"]) if source != filename]
             
-        initial_count = len(store["documents"])
-        # Filter out docs with matching source
-        store["documents"] = [d for d in store["documents"] if d["source"] != filename]
-        
-        if len(store["documents"]) < initial_count:
-            self._save_store(conversation_id, store)
-            return True
-            
-        return False
+            if len(keep) < len(store["texts"]):
+                store = {
+                    "matrix": store["matrix"][keep],
+                    "matrix_i8": store["matrix_i8"][keep],
+                    "texts": [store["texts"][i] for i in keep],
+                    "sources": [store["sources"][i] for i in keep],
+                }
+                self._save_store(conversation_id, store)
+                self._cache_store(conversation_id, store)
+                return True
+                
+            return False
 
     def search(self, conversation_id: str, query: str, k: int = 3) -> List[Dict[str, Any]]:
         """
         Search for relevant chunks in the conversation's documents.
         """
         store = self._load_store(conversation_id)
-        if not store["documents"]:
+        if not store["texts"] or k <= 0:
             return []
 
         model = get_embedding_model()
-        query_embedding = model.encode([query])[0]
-
-        # Calculate similarities
-        docs = store["documents"]
-        scores = []
-        for doc in docs:
-            # Cosine similarity
-            score = np.dot(query_embedding, doc["embedding"]) / (
-                np.linalg.norm(query_embedding) * np.linalg.norm(doc["embedding"])
-            )
-            scores.append((score, doc))
-
-        # Sort by score desc
-        scores.sort(key=lambda x: x[0], reverse=True)
+        # Unit query against unit rows: cosine similarity is a plain dot product
+        query_embedding = np.asarray(
+            model.encode([query], normalize_embeddings=True, show_progress_bar=False)[0],
+            dtype=np.float32
+        )
+
+        index = self._get_index(conversation_id, store)
+        if index is not None:
+            # Approximate search: a graph walk instead of a full scan
+            count = len(store["texts"])
+            with self._lock:
+                index.set_ef(max(HNSW_EF_SEARCH, k))
+                # An upload since this store was loaded may have added rows it doesn't have
+                in_store = (lambda label: label < count) if index.get_current_count() > count else None
+                labels, _ = index.knn_query(query_embedding, k=min(k, count), filter=in_store)
+            top = labels[0].astype(np.intp)
+        elif simsimd is None and _similarity.available:
+            # Fused parallel dot product and top-k selection
+            top = _similarity.top_k_dot(self._get_matrix_f32(store), query_embedding, k)
+        else:
+            # Cosine similarity against every chunk at once
+            if simsimd is not None:
+                # int8 scan (4x less memory traffic); SimSIMD returns cosine distance, i.e. 1 - similarity
+                query_i8 = _quantize_rows(query_embedding[None, :])
+                distances = simsimd.cdist(query_i8, store["matrix_i8"], metric="cosine")
+                scores = 1.0 - np.asarray(distances)[0]
+            else:
+                scores = self._get_matrix_f32(store) @ query_embedding
+
+            top = _top_k_indices(scores, k)
+
+        # Rank the chosen chunks by their exact similarity, computed in float32
+        top_scores = store["matrix"][top].astype(np.float32) @ query_embedding
+        order = np.argsort(-top_scores)
         
-        # Return top k
-        results = []
-        for score, doc in scores[:k]:
-            results.append({
-                "text": doc["text"],
-                "source": doc["source"],
+        return [
+            {
+                "text": store["texts"][i],
+                "source": store["sources"][i],
                 "score": float(score)
-            })
-            
-        return results
+            }
+            for i, score in zip(top[order], top_scores[order])
+        ]
 
-    def _load_store(self, conversation_id: str) -> Dict[str, Any]:
-        path = self._get_store_path(conversation_id)
-        if path.exists():
+    def _get_index(self, conversation_id: str, store: Dict[str, Any]):
+        """Get the HNSW index for a large store, loading or building it on first use."""
+        count = len(store["texts"])
+        if hnswlib is None or count < HNSW_MIN_ELEMENTS:
+            return None
+
+        with self._lock:
+            if "index" in store:
+                return store["index"]
+
+            path = self._get_conv_dir(conversation_id) / INDEX_FILE
+            index = hnswlib.Index(space="ip", dim=store["matrix"].shape[1])
             try:
-                with open(path, 'rb') as f:
-                    return pickle.load(f)
+                index.load_index(str(path), max_elements=count)
+                if index.get_current_count() != count:
+                    raise ValueError("index is out of date")
             except Exception:
-                return {"documents": []}
-        return {"documents": []}
+                # Inner product on normalized rows is cosine similarity
+                index = hnswlib.Index(space="ip", dim=store["matrix"].shape[1])
+                index.init_index(max_elements=count, ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+                index.add_items(np.asarray(store["matrix"], dtype=np.float32), np.arange(count))
+                index.save_index(str(path))
+
+            store["index"] = index
+            return index
+
+    def _get_matrix_f32(self, store: Dict[str, Any]) -> np.ndarray:
+        """
+        Get a float32 copy of a store's embeddings for the full-scan paths.
+
+        NumPy and Numba have no fast float16 kernels, so the rows are upcast
+        once per cached store rather than on every search.
+        """
+        with self._lock:
+            if "matrix_f32" not in store:
+                # A no-op for float32 stores written by older versions
+                store["matrix_f32"] = np.asarray(store["matrix"], dtype=np.float32)
+            return store["matrix_f32"]
+
+    def _empty_store(self) -> Dict[str, Any]:
+        return {
+            "matrix": np.empty((0, 0), dtype=EMBEDDING_DTYPE),
+            "matrix_i8": np.empty((0, 0), dtype=np.int8),
+            "texts": [],
+            "sources": [],
+            "chunks_end": 0,
+        }
+
+    def _load_store(self, conversation_id: str) -> Dict[str, Any]:
+        """Get a conversation's store, from memory when recently used."""
+        with self._lock:
+            store = self._stores.get(conversation_id)
+            if store is not None:
+                self._stores.move_to_end(conversation_id)
+                return store
+
+            store = self._read_store(conversation_id)
+            self._cache_store(conversation_id, store)
+            return store
+
+    def _cache_store(self, conversation_id: str, store: Dict[str, Any]):
+        with self._lock:
+            self._stores[conversation_id] = store
+            self._stores.move_to_end(conversation_id)
+            while len(self._stores) > STORE_CACHE_SIZE:
+                self._stores.popitem(last=False)
+
+    def _read_store(self, conversation_id: str) -> Dict[str, Any]:
+        """
+        Read a conversation's store as a structure of arrays.
+
+        'matrix' holds the normalized float16 embeddings (float32 for stores
+        written by older versions), 'matrix_i8' an int8 copy for the SIMD scan,
+        and row i belongs to texts[i] from sources[i].
+        Both matrices are memory-mapped, so only the pages a search touches are read.
+        'chunks_end' is the byte offset in chunks.jsonl where the next chunk goes.
+        """
+        conv_dir = self._get_conv_dir(conversation_id)
+        if not (conv_dir / CHUNKS_FILE).exists():
+            return self._migrate_legacy_store(conversation_id)
+
+        try:
+            matrix = np.load(conv_dir / EMBEDDINGS_FILE, mmap_mode='r')
+            matrix_i8 = np.load(conv_dir / EMBEDDINGS_I8_FILE, mmap_mode='r')
+            lines = _read_jsonl_lines(conv_dir / CHUNKS_FILE)
+            # An interrupted upload can leave extra rows in some files; ignore them
+            count = min(len(matrix), len(matrix_i8), len(lines))
+            records = [orjson.loads(line) for line in lines[:count]]
+        except Exception:
+            return self._empty_store()
+
+        return {
+            "matrix": matrix[:count],
+            "matrix_i8": matrix_i8[:count],
+            "texts": [r["text"] for r in records],
+            "sources": [r["source"] for r in records],
+            "chunks_end": sum(len(line) + 1 for line in lines[:count]),
+        }
 
     def _save_store(self, conversation_id: str, store: Dict[str, Any]):
-        path = self._get_store_path(conversation_id)
-        with open(path, 'wb') as f:
-            pickle.dump(store, f)
-
-    def _extract_pdf(self, file_content: bytes) -> str:
-        import io
-        pdf = PdfReader(io.BytesIO(file_content))
-        text = ""
-        for page in pdf.pages:
-            text += page.extract_text() + "\n"
-        return text
+        """Rewrite a conversation's store files, e.g. after removing a file."""
+        conv_dir = self._get_conv_dir(conversation_id)
+        # Row ids have shifted, so the index is rebuilt on the next search
+        (conv_dir / INDEX_FILE).unlink(missing_ok=True)
+        if not store["texts"]:
+            for name in (EMBEDDINGS_FILE, EMBEDDINGS_I8_FILE, CHUNKS_FILE):
+                (conv_dir / name).unlink(missing_ok=True)
+            store["chunks_end"] = 0
+            return
+
+        # Write to temporary files and swap them in, so readers holding a
+        # memory map of the old files are unaffected
+        arrays = (
+            (EMBEDDINGS_FILE, np.ascontiguousarray(store["matrix"], dtype=EMBEDDING_DTYPE)),
+            (EMBEDDINGS_I8_FILE, np.ascontiguousarray(store["matrix_i8"])),
+        )
+        for name, array in arrays:
+            tmp = conv_dir / f"{name}.tmp"
+            with open(tmp, 'wb') as f:
+                np.save(f, array)
+            os.replace(tmp, conv_dir / name)
+
+        tmp = conv_dir / f"{CHUNKS_FILE}.tmp"
+        store["chunks_end"] = _append_jsonl(tmp, 0, [
+            {"text": text, "source": source}
+            for text, source in zip(store["texts"], store["sources"])
+        ])
+        os.replace(tmp, conv_dir / CHUNKS_FILE)
+
+    def _migrate_legacy_store(self, conversation_id: str) -> Dict[str, Any]:
+        """Convert a pickled store.pkl from older versions to the current files."""
+        path = self._get_conv_dir(conversation_id) / LEGACY_STORE_FILE
+        if not path.exists():
+            return self._empty_store()
+
+        try:
+            with open(path, 'rb') as f:
+                store = pickle.load(f)
+        except Exception:
+            return self._empty_store()
+
+        if "documents" in store:
+            # Oldest stores kept a list of {'text', 'embedding', 'source'} dicts
+            docs = store["documents"]
+            if not docs:
+                store = self._empty_store()
+            else:
+                store = {
+                    "matrix": _normalize_rows(np.array([d["embedding"] for d in docs], dtype=np.float32)),
+                    "texts": [d["text"] for d in docs],
+                    "sources": [d["source"] for d in docs],
+                }
+        if store["texts"] and "matrix_i8" not in store:
+            store["matrix_i8"] = _quantize_rows(store["matrix"])
+
+        self._save_store(conversation_id, store)
+        path.unlink()
+        return store
 
 # Global instance
 rag_engine = RAGEngine()
@@ -0,0 +1,35 @@
+"""Async token bucket used to throttle requests before the provider does."""
+
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket holding up to `capacity` tokens, refilled evenly over `period` seconds.
+
+    Waiters are served in FIFO order. Requests larger than the capacity are
+    clamped to it so they can never block forever.
+    """
+
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1.0):
+        """Wait until `amount` tokens are available, then consume them."""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+
+                await asyncio.sleep((amount - self._tokens) / self.rate)
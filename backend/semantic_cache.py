@@ -0,0 +1,165 @@
+"""Semantic response cache for council and chairman queries."""
+
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .config import SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES
+from .rag import get_embedding_model
+
+
+def make_namespace(model: str, *parts: Any) -> str:
+    """
+    Build a cache namespace from a model id and the exact-match context.
+
+    Only the user query is compared semantically; everything else that shapes
+    the prompt (history, RAG context, stage 1 text) must match exactly.
+    """
+    digest = hashlib.blake2b(
+        json.dumps(parts, sort_keys=True, separators=(",", ":")).encode("utf-8"),
+        digest_size=16
+    ).hexdigest()
+    return f"{model}:{digest}"
+
+
+@lru_cache(maxsize=128)
+def _encode(text: str) -> np.ndarray:
+    model = get_embedding_model()
+    return np.asarray(model.encode(text, normalize_embeddings=True), dtype=np.float32)
+
+
+def _try_encode(text: str) -> Optional[np.ndarray]:
+    try:
+        return _encode(text)
+    except Exception as e:
+        print(f"Semantic cache encode failed: {e}")
+        return None
+
+
+class SemanticCache:
+    """
+    In-memory LRU cache of LLM responses keyed by prompt embeddings.
+
+    A lookup hits when a previously stored text in the same namespace has
+    cosine similarity >= threshold with the query text.
+    """
+
+    def __init__(
+        self,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # LRU order over (namespace, text) keys
+        self._lru: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+        # namespace -> {text: (embedding, response)}
+        self._entries: Dict[str, Dict[str, Tuple[np.ndarray, Dict[str, Any]]]] = {}
+        # namespace -> (texts, stacked embeddings), rebuilt lazily after writes
+        self._matrices: Dict[str, Tuple[List[str], np.ndarray]] = {}
+
+    def lookup(
+        self,
+        namespace: str,
+        text: str,
+        embedding: Optional[np.ndarray] = None
+    ) -> Optional[Dict[str, Any]]:
+        """Return the cached response for a near-duplicate text, or None."""
+        entries = self._entries.get(namespace)
+        if not entries:
+            return None
+
+        if text in entries:
+            self._lru.move_to_end((namespace, text))
+            return entries[text][1]
+
+        if embedding is None:
+            embedding = _try_encode(text)
+            if embedding is None:
+                return None
+
+        texts, matrix = self._get_matrix(namespace)
+        sims = matrix @ embedding
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            return None
+
+        self._lru.move_to_end((namespace, texts[best]))
+        return entries[texts[best]][1]
+
+    def store(
+        self,
+        namespace: str,
+        text: str,
+        response: Dict[str, Any],
+        embedding: Optional[np.ndarray] = None
+    ):
+        """Cache a response, evicting the least recently used entry if full."""
+        if embedding is None:
+            embedding = _try_encode(text)
+            if embedding is None:
+                return
+
+        self._entries.setdefault(namespace, {})[text] = (embedding, response)
+        self._lru[(namespace, text)] = None
+        self._lru.move_to_end((namespace, text))
+        self._matrices.pop(namespace, None)
+
+        while len(self._lru) > self.max_entries:
+            (old_namespace, old_text), _ = self._lru.popitem(last=False)
+            entries = self._entries[old_namespace]
+            del entries[old_text]
+            if not entries:
+                del self._entries[old_namespace]
+            self._matrices.pop(old_namespace, None)
+
+    async def embed(self, text: str) -> Optional[np.ndarray]:
+        """
+        Embed text in a worker thread, so loading the model or encoding never
+        blocks the event loop. Returns None if encoding failed.
+        """
+        return await asyncio.to_thread(_try_encode, text)
+
+    async def get_or_query(
+        self,
+        namespace: str,
+        text: str,
+        query: Callable[[], Awaitable[Optional[Dict[str, Any]]]],
+        embedding: Optional[np.ndarray] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Return a cached response for text, or await query() and cache its result.
+
+        Failed queries (None) are not cached. Pass the embedding from embed()
+        when several namespaces share the same text.
+        """
+        if embedding is None:
+            embedding = await self.embed(text)
+        if embedding is None:
+            return await query()
+
+        cached = self.lookup(namespace, text, embedding)
+        if cached is not None:
+            return cached
+
+        response = await query()
+        if response is not None:
+            self.store(namespace, text, response, embedding)
+        return response
+
+    def _get_matrix(self, namespace: str) -> Tuple[List[str], np.ndarray]:
+        if namespace not in self._matrices:
+            entries = self._entries[namespace]
+            texts = list(entries)
+            matrix = np.stack([entries[t][0] for t in texts])
+            self._matrices[namespace] = (texts, matrix)
+        return self._matrices[namespace]
+
+
+# Global instance
+semantic_cache = SemanticCache()
@@ -2,63 +2,100 @@
 
 import json
 import logging
+from collections import OrderedDict
 from typing import List, Dict, Any, Optional
 from datetime import datetime
-from sqlalchemy import select, desc
+from sqlalchemy import select, desc, func, insert
+from sqlalchemy.orm import joinedload
 
-from .database import AsyncSessionLocal, ConversationModel, MessageModel, init_db
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .database import ConversationModel, MessageModel, init_db
 
 logger = logging.getLogger(__name__)
 
+# Message columns a caller can set through add_messages()
+MESSAGE_COLUMNS = (
+    "role", "content", "stage1_results", "stage2_results", "stage3_result", "metadata_json"
+)
+
+# Read caches for conversations and chat histories, invalidated on every write
+CACHE_SIZE = 256
+_conv_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_hist_cache: "OrderedDict[str, List[Dict[str, str]]]" = OrderedDict()
+
+# Bumped on every write so a read that raced a write doesn't cache stale data
+_write_versions: Dict[str, int] = {}
+
+def _cache_get(cache: OrderedDict, conversation_id: str) -> Optional[Any]:
+    value = cache.get(conversation_id)
+    if value is not None:
+        cache.move_to_end(conversation_id)
+    return value
+
+def _cache_put(cache: OrderedDict, conversation_id: str, value: Any, version: int):
+    if _write_versions.get(conversation_id, 0) != version:
+        return
+    cache[conversation_id] = value
+    cache.move_to_end(conversation_id)
+    while len(cache) > CACHE_SIZE:
+        cache.popitem(last=False)
+
+def _invalidate(conversation_id: str):
+    _write_versions[conversation_id] = _write_versions.get(conversation_id, 0) + 1
+    _conv_cache.pop(conversation_id, None)
+    _hist_cache.pop(conversation_id, None)
+
 async def initialize_storage():
     """Initialize the storage system (database)."""
     await init_db()
 
-async def create_conversation(conversation_id: str) -> Dict[str, Any]:
+async def create_conversation(session: AsyncSession, conversation_id: str) -> Dict[str, Any]:
     """
     Create a new conversation.
     """
-    async with AsyncSessionLocal() as session:
+    async with session.begin():
         new_conv = ConversationModel(
             id=conversation_id,
             title="New Conversation",
             created_at=datetime.utcnow()
         )
         session.add(new_conv)
-        await session.commit()
         
-        return {
-            "id": new_conv.id,
-            "created_at": new_conv.created_at.isoformat(),
-            "title": new_conv.title,
-            "messages": []
-        }
+    return {
+        "id": new_conv.id,
+        "created_at": new_conv.created_at.isoformat(),
+        "title": new_conv.title,
+        "messages": []
+    }
 
-async def get_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
+async def get_conversation(session: AsyncSession, conversation_id: str) -> Optional[Dict[str, Any]]:
     """
     Load a conversation from storage.
     """
-    async with AsyncSessionLocal() as session:
-        # Get conversation
+    cached = _cache_get(_conv_cache, conversation_id)
+    if cached is not None:
+        return cached
+
+    version = _write_versions.get(conversation_id, 0)
+    async with session.begin():
+        # Get conversation and its messages in one round trip
         result = await session.execute(
-            select(ConversationModel).where(ConversationModel.id == conversation_id)
+            select(ConversationModel)
+            .options(joinedload(ConversationModel.messages).undefer_group("stages"))
+            .where(ConversationModel.id == conversation_id)
+            # The session may already hold this conversation from an earlier
+            # operation in the request; refresh it and its messages
+            .execution_options(populate_existing=True)
         )
-        conv = result.scalar_one_or_none()
+        conv = result.unique().scalar_one_or_none()
         
         if not conv:
             return None
-            
-        # Get messages
-        result = await session.execute(
-            select(MessageModel)
-            .where(MessageModel.conversation_id == conversation_id)
-            .order_by(MessageModel.created_at)
-        )
-        messages = result.scalars().all()
         
         # Format messages
         formatted_messages = []
-        for msg in messages:
+        for msg in conv.messages:
             if msg.role == "user":
                 formatted_messages.append({
                     "role": "user",
@@ -74,25 +111,54 @@ async def get_conversation(conversation_id: str) -> Optional[Dict[str, Any]]:
                     "metadata": msg.metadata_json
                 })
                 
-        return {
+        conversation = {
             "id": conv.id,
             "created_at": conv.created_at.isoformat(),
             "title": conv.title,
             "messages": formatted_messages
         }
 
-async def get_chat_history(conversation_id: str) -> List[Dict[str, str]]:
+    _cache_put(_conv_cache, conversation_id, conversation, version)
+    return conversation
+
+async def conversation_exists_and_count(session: AsyncSession, conversation_id: str) -> Optional[int]:
+    """
+    Get the number of messages in a conversation without loading them.
+    Returns None if the conversation does not exist.
+    """
+    cached = _cache_get(_conv_cache, conversation_id)
+    if cached is not None:
+        return len(cached["messages"])
+
+    async with session.begin():
+        message_count = (
+            select(func.count(MessageModel.id))
+            .where(MessageModel.conversation_id == conversation_id)
+            .scalar_subquery()
+        )
+        result = await session.execute(
+            select(message_count).where(ConversationModel.id == conversation_id)
+        )
+        return result.scalar_one_or_none()
+
+async def get_chat_history(session: AsyncSession, conversation_id: str) -> List[Dict[str, str]]:
     """
     Get simplified chat history for LLM context.
     Returns list of {'role': 'user'|'assistant', 'content': '...'}
     """
-    async with AsyncSessionLocal() as session:
+    cached = _cache_get(_hist_cache, conversation_id)
+    if cached is not None:
+        return list(cached)
+
+    version = _write_versions.get(conversation_id, 0)
+    async with session.begin():
+        # Only role and content; the stage results are never needed here
         result = await session.execute(
-            select(MessageModel)
+            select(MessageModel.role, MessageModel.content)
             .where(MessageModel.conversation_id == conversation_id)
-            .order_by(MessageModel.created_at)
+            .order_by(MessageModel.created_at, MessageModel.id)
         )
-        messages = result.scalars().all()
+        messages = result.all()
         
         history = []
         for msg in messages:
@@ -103,58 +169,77 @@ async def get_chat_history(conversation_id: str) -> List[Dict[str, str]]:
                     "role": msg.role,
                     "content": msg.content
                 })
-                
-        return history
 
-async def list_conversations() -> List[Dict[str, Any]]:
+    _cache_put(_hist_cache, conversation_id, history, version)
+    return list(history)
+
+async def list_conversations(session: AsyncSession) -> List[Dict[str, Any]]:
     """
     List all conversations (metadata only).
     """
-    async with AsyncSessionLocal() as session:
-        # Get all conversations sorted by date
+    async with session.begin():
+        # Get all conversations sorted by date, with message counts aggregated
+        # in the same query
         result = await session.execute(
-            select(ConversationModel).order_by(desc(ConversationModel.created_at))
+            select(ConversationModel, func.count(MessageModel.id).label("msg_count"))
+            .outerjoin(MessageModel, MessageModel.conversation_id == ConversationModel.id)
+            .group_by(ConversationModel.id)
+            .order_by(desc(ConversationModel.created_at))
         )
-        conversations = result.scalars().all()
-        
-        # For message counts, we would ideally do a join or subquery, 
-        # but for simplicity effectively doing N+1 or just not showing count requires thought.
-        # Let's do a simple count query for each or just skip message count for MVP speed.
-        # To match previous API, we need message_count.
         
-        # Let's fetch all conversations
-        output = []
-        for conv in conversations:
-            # Count messages
-            msg_count_res = await session.execute(
-                select(MessageModel).where(MessageModel.conversation_id == conv.id)
-            )
-            count = len(msg_count_res.scalars().all())
-            
-            output.append({
+        return [
+            {
                 "id": conv.id,
                 "created_at": conv.created_at.isoformat(),
                 "title": conv.title,
-                "message_count": count
-            })
-            
-        return output
+                "message_count": msg_count
+            }
+            for conv, msg_count in result.all()
+        ]
+
+async def add_messages(session: AsyncSession, conversation_id: str, *messages: Dict[str, Any]):
+    """
+    Add several messages to a conversation in a single transaction.
 
-async def add_user_message(conversation_id: str, content: str):
+    Each message is a dict of MessageModel column values, e.g.
+    {"role": "user", "content": "..."}; omitted columns are stored as NULL.
+    """
+    now = datetime.utcnow()
+    rows = [
+        {
+            "conversation_id": conversation_id,
+            "created_at": now,
+            **{column: message.get(column) for column in MESSAGE_COLUMNS}
+        }
+        for message in messages
+    ]
+    async with session.begin():
+        await session.execute(insert(MessageModel), rows)
+    _invalidate(conversation_id)
+
+def _assistant_message(
+    stage1: List[Dict[str, Any]],
+    stage2: List[Dict[str, Any]],
+    stage3: Dict[str, Any],
+    metadata: Dict[str, Any] = None
+) -> Dict[str, Any]:
+    return {
+        "role": "assistant",
+        "content": stage3.get("response", ""), # Store final response as content for easy access
+        "stage1_results": stage1,
+        "stage2_results": stage2,
+        "stage3_result": stage3,
+        "metadata_json": metadata
+    }
+
+async def add_user_message(session: AsyncSession, conversation_id: str, content: str):
     """
     Add a user message to a conversation.
     """
-    async with AsyncSessionLocal() as session:
-        msg = MessageModel(
-            conversation_id=conversation_id,
-            role="user",
-            content=content,
-            created_at=datetime.utcnow()
-        )
-        session.add(msg)
-        await session.commit()
+    await add_messages(session, conversation_id, {"role": "user", "content": content})
 
 async def add_assistant_message(
+    session: AsyncSession,
     conversation_id: str,
     stage1: List[Dict[str, Any]],
     stage2: List[Dict[str, Any]],
@@ -164,29 +249,36 @@ async def add_assistant_message(
     """
     Add an assistant message with all 3 stages.
     """
-    async with AsyncSessionLocal() as session:
-        msg = MessageModel(
-            conversation_id=conversation_id,
-            role="assistant",
-            content=stage3.get("response", ""), # Store final response as content for easy access
-            stage1_results=stage1,
-            stage2_results=stage2,
-            stage3_result=stage3,
-            metadata_json=metadata,
-            created_at=datetime.utcnow()
-        )
-        session.add(msg)
-        await session.commit()
+    await add_messages(session, conversation_id, _assistant_message(stage1, stage2, stage3, metadata))
+
+async def add_turn(
+    session: AsyncSession,
+    conversation_id: str,
+    user_content: str,
+    stage1: List[Dict[str, Any]],
+    stage2: List[Dict[str, Any]],
+    stage3: Dict[str, Any],
+    metadata: Dict[str, Any] = None
+):
+    """
+    Add a user message and its assistant reply in a single transaction.
+    """
+    await add_messages(
+        session,
+        conversation_id,
+        {"role": "user", "content": user_content},
+        _assistant_message(stage1, stage2, stage3, metadata)
+    )
 
-async def update_conversation_title(conversation_id: str, title: str):
+async def update_conversation_title(session: AsyncSession, conversation_id: str, title: str):
     """
     Update the title of a conversation.
     """
-    async with AsyncSessionLocal() as session:
+    async with session.begin():
         result = await session.execute(
             select(ConversationModel).where(ConversationModel.id == conversation_id)
         )
         conv = result.scalar_one_or_none()
         if conv:
             conv.title = title
-            await session.commit()
+    _invalidate(conversation_id)
@@ -57,9 +57,13 @@ function App() {
     setCurrentConversationId(id);
   };
 
-  const handleUploadFile = async (file) => {
+  const handleUploadFiles = async (files) => {
     if (!currentConversationId) return;
-    return await api.uploadFile(currentConversationId, file);
+    if (files.length === 1) {
+      return [await api.uploadFile(currentConversationId, files[0])];
+    }
+    const result = await api.uploadFiles(currentConversationId, files);
+    return result.files;
   };
 
   const handleDeleteFile = async (filename) => {
@@ -110,6 +114,16 @@ function App() {
             });
             break;
 
+          case 'stage1_model':
+            setCurrentConversation((prev) => {
+              const messages = [...prev.messages];
+              const lastMsg = messages[messages.length - 1];
+              // Show each council response as soon as it arrives
+              lastMsg.stage1 = [...(lastMsg.stage1 || []), event.data];
+              return { ...prev, messages };
+            });
+            break;
+
           case 'stage1_complete':
             setCurrentConversation((prev) => {
               const messages = [...prev.messages];
@@ -161,6 +175,16 @@ function App() {
             });
             break;
 
+          case 'stage3_revision':
+            setCurrentConversation((prev) => {
+              const messages = [...prev.messages];
+              const lastMsg = messages[messages.length - 1];
+              // Chairman re-synthesized with council responses that arrived late
+              lastMsg.stage3 = event.data;
+              return { ...prev, messages };
+            });
+            break;
+
           case 'title_complete':
             // Reload conversations to get updated title
             loadConversations();
@@ -203,7 +227,7 @@ function App() {
       <ChatInterface
         conversation={currentConversation}
         onSendMessage={handleSendMessage}
-        onUploadFile={handleUploadFile}
+        onUploadFiles={handleUploadFiles}
         onDeleteFile={handleDeleteFile}
         isLoading={isLoading}
       />
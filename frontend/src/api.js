@@ -135,6 +135,29 @@ export const api = {
     return response.json();
   },
 
+  /**
+   * Upload several files for RAG context in one request.
+   */
+  async uploadFiles(conversationId, files) {
+    const formData = new FormData();
+    for (const file of files) {
+      formData.append('files', file);
+    }
+
+    const response = await fetch(
+      `${API_BASE}/api/conversations/${conversationId}/uploads`,
+      {
+        method: 'POST',
+        body: formData,
+      }
+    );
+    if (!response.ok) {
+      const error = await response.json();
+      throw new Error(error.detail || 'Failed to upload files');
+    }
+    return response.json();
+  },
+
   /**
    * Delete a file from RAG context.
    */
@@ -7,7 +7,7 @@ import './ChatInterface.css';
 export default function ChatInterface({
   conversation,
   onSendMessage,
-  onUploadFile,
+  onUploadFiles,
   onDeleteFile,
 }) {
   const [input, setInput] = useState('');
@@ -40,14 +40,19 @@ export default function ChatInterface({
   };
 
   const handleFileChange = async (e) => {
-    const file = e.target.files?.[0];
-    if (!file) return;
+    const files = Array.from(e.target.files || []);
+    if (files.length === 0) return;
 
     setUploadStatus('Uploading...');
     try {
-      const result = await onUploadFile(file);
-      setUploadStatus('');
-      setUploadedFiles(prev => [...prev, { name: result.filename, id: Date.now() }]);
+      const results = await onUploadFiles(files);
+      const uploaded = results.filter(r => !r.error);
+      const failed = results.filter(r => r.error);
+      setUploadStatus(failed.length ? `Error: ${failed.map(r => `${r.filename}: ${r.error}`).join('; ')}` : '');
+      setUploadedFiles(prev => [
+        ...prev,
+        ...uploaded.map((r, i) => ({ name: r.filename, id: Date.now() + i })),
+      ]);
     } catch (error) {
       setUploadStatus(`Error: ${error.message}`);
     }
@@ -154,6 +159,7 @@ export default function ChatInterface({
               onChange={handleFileChange}
               style={{ display: 'none' }}
               accept=".pdf,.txt,.md"
+              multiple
             />
 
             <textarea